@@ -2,85 +2,714 @@
 """
 Observations MCP server (FastMCP version, no `schema=` arguments)
 
-- Append-only NDJSON log with file locking
+- Append-only NDJSON logs, one per session (O_APPEND + advisory lock), flushed in batches
 - Private, no-arg bootstrap_session that loads {user_id, ourn, ...} from a local file
 - start_thread / append_event / list_events tools
+- In-memory block index so filtered list_events calls skip unrelated parts of the log
 - Active-session defaulting so the LLM doesn't need to pass session_id
 
 Env vars:
   OBS_CONTEXT_PATH  -> path to private_context.json (default: ./private_context.json)
-  OBS_LOG_PATH      -> path to observations.ndjson (default: ./observations.ndjson)
+  OBS_LOG_PATH      -> path to observations.ndjson (default: ./observations.ndjson);
+                       each session logs to observations.<session_id>.ndjson next to it
 
 CLI args:
   --log-dir   directory to place the log file (default: current directory)
   --log-file  log filename (default: observations.ndjson)
 """
 import os
+import re
+import sys
 import json
-import uuid
-import secrets
+import heapq
+import math
+import mmap
+import time
+import atexit
 import datetime
 import pathlib
 import argparse
-from typing import Any, Dict, Iterable, List, Optional, Literal
+import functools
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Literal,
+    get_args,
+)
 
-from filelock import FileLock
 from mcp.server.fastmcp import FastMCP
 
+try:
+    import orjson
+except ImportError:  # optional; msgspec or stdlib json are the fallbacks
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # optional
+    msgspec = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 # --------------------
 # Config
 # --------------------
 APP_NAME = "observations"
 LOG_PATH = pathlib.Path(os.environ.get("OBS_LOG_PATH", "./observations.ndjson"))
-LOCK_PATH = pathlib.Path(str(LOG_PATH) + ".lock")
 CONTEXT_PATH = pathlib.Path(
     os.environ.get("OBS_CONTEXT_PATH", "./private_context.json")
 )
+FLUSH_BYTES = 64 * 1024  # wake the writer once this much is queued...
+FLUSH_INTERVAL = 0.25  # ...or at most this many seconds after the first event
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else -1
+IOV_MAX = IOV_MAX if IOV_MAX > 0 else 1024  # -1 means "no fixed limit"
+INDEX_BLOCK_BYTES = 64 * 1024  # granularity of the list_events block index
+MAX_OPEN_LOGS = 256  # per-session log fds kept open, least recently used closed first
+MAX_INDEXED_LOGS = 1024  # block indexes kept in memory, least recently used dropped first
 
 # --------------------
 # In-memory state (private; not written to NDJSON)
 # --------------------
 _PRIVATE_CTX: Dict[str, Dict[str, Any]] = {}  # session_id -> {user_id, ourn, ...}
+_PRIVATE_CTX_LOCK = threading.Lock()
+# Most recently bootstrapped session, process-wide. Not a ContextVar: FastMCP runs each
+# request in a fresh copy of the server's context, so a value set by bootstrap_session
+# would be gone by the time start_thread/append_event run.
 _ACTIVE_SESSION_ID: Optional[str] = None
 
+# --------------------
+# Log writer state (long-lived fds per log file, a writer thread drains queued lines in batches)
+# --------------------
+_LOG_FDS: "collections.OrderedDict[pathlib.Path, int]" = collections.OrderedDict()
+_PENDING: Deque[Tuple[pathlib.Path, bytes]] = collections.deque()
+_PENDING_BYTES = 0
+_PENDING_LOCK = threading.Lock()  # guards _PENDING/_PENDING_BYTES
+_FLUSH_LOCK = threading.Lock()  # serializes batches so they hit the log in order
+_HAS_DATA = threading.Event()
+_FULL = threading.Event()
+_WRITER: Optional[threading.Thread] = None
+_DIR_READY = False  # LOG_PATH.parent has been created
+_WRITE_ERROR: Optional[str] = None  # why the last batch failed; cleared by the next good one
+_RAND_POOL = bytearray()  # urandom read 4 KiB at a time, sliced into ids
+_RAND_LOCK = threading.Lock()
+_SCAN_POOL = ThreadPoolExecutor(
+    max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="obs-scan"
+)
+_TS_CACHE = (0, "")  # (epoch second, its ISO string); swapped as one tuple so readers never see a torn pair
+
+
+# --------------------
+# Serialization (compact NDJSON; orjson or msgspec when available)
+# --------------------
+# Stdlib codec: the fallback, and the reference for what a line looks like. Non-finite
+# floats are written as null (as orjson and msgspec do) instead of bare NaN/Infinity.
+# json.dumps/loads with non-default options build a new encoder/decoder per call.
+_std_encode = json.JSONEncoder(
+    ensure_ascii=False, separators=(",", ":"), allow_nan=False
+).encode
+_std_decode = json.JSONDecoder().decode
+
+
+def _finite(obj: Any) -> Any:
+    """`obj` with NaN/Infinity floats replaced by None."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    return obj
+
+
+def _std_dumps(obj: Any) -> bytes:
+    try:
+        s = _std_encode(obj)
+    except ValueError:  # non-finite float somewhere
+        s = _std_encode(_finite(obj))
+    return s.encode("utf-8")
+
+
+def _std_loads(data: bytes) -> Any:
+    # Also accepts the NaN/Infinity that older versions of this server wrote.
+    return _std_decode(data.decode("utf-8"))
+
+
+if orjson is not None:
+    _fast_dumps, _fast_loads = orjson.dumps, orjson.loads
+    _ENCODE_ERRORS: Tuple[type, ...] = (orjson.JSONEncodeError,)
+    _DECODE_ERRORS: Tuple[type, ...] = (orjson.JSONDecodeError,)
+elif msgspec is not None:
+    _fast_dumps = msgspec.json.Encoder().encode
+    _fast_loads = msgspec.json.Decoder().decode
+    _ENCODE_ERRORS = (msgspec.EncodeError, TypeError, OverflowError)
+    _DECODE_ERRORS = (msgspec.DecodeError,)
+else:
+    _fast_dumps = _fast_loads = None
+
+if _fast_dumps is None:
+    _dumps, _loads = _std_dumps, _std_loads
+else:
+
+    def _dumps(obj: Any) -> bytes:
+        try:
+            return _fast_dumps(obj)
+        except _ENCODE_ERRORS:  # e.g. ints beyond 64 bits, non-str dict keys
+            return _std_dumps(obj)
+
+    def _loads(data: bytes) -> Any:
+        try:
+            return _fast_loads(data)
+        except _DECODE_ERRORS:  # e.g. NaN/Infinity in lines from older versions
+            return _std_loads(data)
+
+# Envelope for append_event; id/ts/kind are generated or validated here and
+# need no escaping, everything caller-supplied goes through _dumps.
+_EVENT_TMPL = (
+    b'{"id":"%s","ts":"%s","actor":%s,"session_id":%s,"activity_id":%s,'
+    b'"thread_id":%s,"kind":"%s","tags":%s,"data":%s,"confidence":%s,"supersedes":%s}\n'
+)
+# bootstrap_session: only the generated id/ts/session_id vary.
+_SESSION_START_TMPL = (
+    b'{"id":"%s","ts":"%s","actor":"system","session_id":"%s","activity_id":null,'
+    b'"thread_id":null,"kind":"state","tags":["session_start"],"data":{"meta":"started"}}\n'
+)
+# start_thread: session_id, activity_id and metadata come from the caller.
+_THREAD_START_TMPL = (
+    b'{"id":"%s","ts":"%s","actor":"system","session_id":%s,"activity_id":%s,'
+    b'"thread_id":"%s","kind":"state","tags":["thread_start"],"data":{"metadata":%s}}\n'
+)
+
 
 # --------------------
 # Helpers
 # --------------------
 def now_iso() -> str:
-    return datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
+    """UTC timestamp at 1-second resolution; formatted once per second and reused."""
+    global _TS_CACHE
+    t = int(time.time())
+    cached_t, cached_s = _TS_CACHE
+    if cached_t == t:
+        return cached_s
+    s = _format_ts(t)
+    _TS_CACHE = (t, s)
+    return s
 
 
-def _append_line(obj: Dict[str, Any]) -> Dict[str, Any]:
-    LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with FileLock(str(LOCK_PATH)):
-        with LOG_PATH.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(obj, ensure_ascii=False) + "\n")
-    return obj
+def _new_id(prefix: str, nbytes: int) -> str:
+    """`prefix` + `nbytes` random bytes as hex, drawn from a refillable urandom pool."""
+    with _RAND_LOCK:
+        if len(_RAND_POOL) < nbytes:
+            _RAND_POOL.extend(os.urandom(4096))
+        b = _RAND_POOL[:nbytes]
+        del _RAND_POOL[:nbytes]
+    return prefix + b.hex()
+
+
+if hasattr(os, "register_at_fork"):  # a forked child must not replay the parent's pool
+    os.register_at_fork(after_in_child=_RAND_POOL.clear)
+
 
+def _format_ts(t: int) -> str:
+    """Epoch seconds -> the log's fixed timestamp format (YYYY-MM-DDTHH:MM:SSZ)."""
+    # Not strftime: glibc's %Y drops the zero padding for years < 1000, which
+    # would break string comparison against far-past `since`/`until` bounds.
+    return "%04d-%02d-%02dT%02d:%02d:%02dZ" % time.gmtime(t)[:6]
 
-def _iter_events() -> Iterable[Dict[str, Any]]:
-    if not LOG_PATH.exists():
+
+@functools.lru_cache(maxsize=4096)  # log lines share timestamps heavily
+def _parse_ts(s: str) -> float:
+    """ISO8601 -> epoch seconds; naive values are taken as UTC, like the log's own."""
+    dt = datetime.datetime.fromisoformat(s.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+_SAFE_SESSION_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+@functools.lru_cache(maxsize=1024)
+def _shard_path_for(log_path: pathlib.Path, session_id: Optional[str]) -> pathlib.Path:
+    if session_id and _SAFE_SESSION_ID.fullmatch(session_id):
+        return log_path.with_name(f"{log_path.stem}.{session_id}{log_path.suffix}")
+    return log_path
+
+
+def _shard_path(session_id: Optional[str]) -> pathlib.Path:
+    """The session's own log file; ids that aren't filename-safe stay in LOG_PATH."""
+    return _shard_path_for(LOG_PATH, session_id)
+
+
+def _shard_paths() -> List[pathlib.Path]:
+    """LOG_PATH (which also holds events from before sharding) plus every session log."""
+    prefix, suffix = LOG_PATH.stem + ".", LOG_PATH.suffix
+    paths = [LOG_PATH]
+    try:
+        entries = list(os.scandir(LOG_PATH.parent))
+    except FileNotFoundError:
+        return paths
+    for e in entries:
+        name = e.name
+        if (
+            len(name) > len(prefix) + len(suffix)
+            and name.startswith(prefix)
+            and name.endswith(suffix)
+            and _SAFE_SESSION_ID.fullmatch(name[len(prefix) : len(name) - len(suffix)])
+        ):
+            paths.append(LOG_PATH.parent / name)
+    return paths
+
+
+def _ensure_log_dir() -> None:
+    global _DIR_READY
+    if not _DIR_READY:
+        LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _DIR_READY = True
+
+
+def _log_fd(path: pathlib.Path) -> int:
+    """
+    Return the O_APPEND fd for `path`, opening it on first use and closing the least
+    recently used one beyond MAX_OPEN_LOGS. Caller holds _FLUSH_LOCK.
+    """
+    fd = _LOG_FDS.get(path)
+    if fd is not None:
+        _LOG_FDS.move_to_end(path)
+        return fd
+    global _DIR_READY
+    _ensure_log_dir()
+    flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0)
+    try:
+        fd = os.open(path, flags, 0o644)
+    except FileNotFoundError:  # directory removed while running
+        _DIR_READY = False
+        _ensure_log_dir()
+        fd = os.open(path, flags, 0o644)
+    _LOG_FDS[path] = fd
+    if len(_LOG_FDS) > MAX_OPEN_LOGS:
+        os.close(_LOG_FDS.popitem(last=False)[1])
+    return fd
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+def _write_chunks(fd: int, chunks: List[bytes]) -> None:
+    if not hasattr(os, "writev"):
+        _write_all(fd, b"".join(chunks))
         return
-    with LOG_PATH.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                yield json.loads(line)
+    for i in range(0, len(chunks), IOV_MAX):
+        group = chunks[i : i + IOV_MAX]
+        written = os.writev(fd, group)
+        total = sum(map(len, group))
+        if written < total:  # short write: finish the remainder the slow way
+            _write_all(fd, b"".join(group)[written:])
+
+
+def _restore_tail(fd: int, size: int) -> None:
+    """Drop a partially written batch; failing that, at least end the file with a newline."""
+    try:
+        os.ftruncate(fd, size)
+    except OSError:
+        try:
+            _write_all(fd, b"\n")
+        except OSError:
+            pass
+
+
+def _write_locked(fd: int, chunks: List[bytes]) -> None:
+    """
+    Append `chunks` while holding an exclusive lock so other processes' batches don't interleave.
+    Uses one gather write (writev) per IOV_MAX chunks where the platform has it.
+    If a write fails the file is cut back to where it was, so no torn line is left
+    for the next batch to be appended onto.
+    """
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+    try:
+        start = os.fstat(fd).st_size
+        try:
+            _write_chunks(fd, chunks)
+        except OSError:
+            _restore_tail(fd, start)
+            raise
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def _flush() -> None:
+    """
+    Write every queued line, one batch per log file. A failure is kept in
+    _WRITE_ERROR (and reported on stderr) instead of raised, so it reaches the
+    next writing tool call rather than whichever caller happened to flush.
+    """
+    global _PENDING_BYTES, _WRITE_ERROR
+    with _FLUSH_LOCK:
+        with _PENDING_LOCK:
+            _HAS_DATA.clear()
+            if not _PENDING:
+                return
+            batch = list(_PENDING)
+            _PENDING.clear()
+            _PENDING_BYTES = 0
+        by_path: Dict[pathlib.Path, List[bytes]] = {}
+        for path, line in batch:
+            by_path.setdefault(path, []).append(line)
+        error: Optional[OSError] = None
+        for path, lines in by_path.items():
+            try:
+                _write_locked(_log_fd(path), lines)
+            except OSError as e:  # the other logs in this batch still get written
+                error = error or e
+        if error is None:
+            _WRITE_ERROR = None
+        else:
+            _WRITE_ERROR = f"Log write failed: {error}"
+            print(f"{APP_NAME}: {_WRITE_ERROR}", file=sys.stderr)
+
+
+def _writer_loop() -> None:
+    while True:
+        _HAS_DATA.wait()
+        _FULL.wait(FLUSH_INTERVAL)
+        _FULL.clear()
+        _flush()
+
+
+atexit.register(_flush)
+
+
+def _append_raw(line: bytes, session_id: Optional[str]) -> Optional[str]:
+    """
+    Queue one serialized NDJSON line for the session's log; the writer thread does the
+    I/O, so tool calls never wait on disk. While an earlier batch has failed, the line
+    is written synchronously instead and the outcome returned: an error message if
+    the log is still unwritable, None once a write succeeds again.
+    """
+    global _PENDING_BYTES, _WRITER
+    path = _shard_path(session_id)
+    with _PENDING_LOCK:
+        _PENDING.append((path, line))
+        _PENDING_BYTES += len(line)
+        if _WRITER is None:
+            _WRITER = threading.Thread(target=_writer_loop, name="obs-writer", daemon=True)
+            _WRITER.start()
+        _HAS_DATA.set()
+        if _PENDING_BYTES >= FLUSH_BYTES:
+            _FULL.set()
+    if _WRITE_ERROR is None:
+        return None
+    _flush()
+    return _WRITE_ERROR
+
+
+# --------------------
+# Block index
+# --------------------
+class _Block:
+    """A contiguous byte range of the log, the distinct filter values and the time span found in it."""
+
+    __slots__ = (
+        "start",
+        "end",
+        "ts_min",
+        "ts_max",
+        "session_ids",
+        "activity_ids",
+        "thread_ids",
+        "kinds",
+    )
+
+    def __init__(self, start: int) -> None:
+        self.start = self.end = start
+        self.ts_min = math.inf
+        self.ts_max = -math.inf
+        self.session_ids: Set[Optional[str]] = set()
+        self.activity_ids: Set[Optional[str]] = set()
+        self.thread_ids: Set[Optional[str]] = set()
+        self.kinds: Set[Optional[str]] = set()
+
+    def add(self, ev: Dict[str, Any], end: int) -> None:
+        try:
+            self.session_ids.add(ev.get("session_id"))
+            self.activity_ids.add(ev.get("activity_id"))
+            self.thread_ids.add(ev.get("thread_id"))
+            self.kinds.add(ev.get("kind"))
+        except TypeError:
+            # An unhashable value (a list in a hand-edited line) can't equal any
+            # filter argument, so leaving it out of the sets prunes nothing wrongly.
+            for values, key in (
+                (self.session_ids, "session_id"),
+                (self.activity_ids, "activity_id"),
+                (self.thread_ids, "thread_id"),
+                (self.kinds, "kind"),
+            ):
+                value = ev.get(key)
+                if getattr(value, "__hash__", None) is not None:
+                    values.add(value)
+        try:
+            ts = _parse_ts(ev["ts"])  # parsed once here, never per query
+        except (KeyError, TypeError, ValueError):
+            # No usable ts: never let time pruning hide this block.
+            self.ts_min, self.ts_max = -math.inf, math.inf
+            self.end = end
+            return
+        if ts < self.ts_min:
+            self.ts_min = ts
+        if ts > self.ts_max:
+            self.ts_max = ts
+        self.end = end
+
+
+class _LogIndex:
+    """
+    Block index over one NDJSON log, kept in memory and built from the log itself.
+    Each refresh() parses only the bytes appended since the last one, so lines written
+    by other processes or by earlier runs are picked up as well.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.blocks: List[_Block] = []
+        self.upto = 0  # bytes of the log covered by `blocks`
+        self.lock = threading.Lock()
+
+    def refresh(self) -> None:
+        with self.lock:
+            try:
+                f = self.path.open("rb")
+            except FileNotFoundError:
+                self.blocks, self.upto = [], 0
+                return
+            with f:
+                if os.fstat(f.fileno()).st_size < self.upto:  # truncated/replaced
+                    self.blocks, self.upto = [], 0
+                f.seek(self.upto)
+                carry = b""
+                while True:
+                    chunk = f.read(1 << 20)
+                    if not chunk:
+                        break
+                    data = carry + chunk
+                    cut = data.rfind(b"\n") + 1
+                    carry = data[cut:]
+                    self._add_lines(data[:cut])
+
+    def _add_lines(self, data: bytes) -> None:
+        lines = data.splitlines(keepends=True)
+        decoded = _loads_batch([line for line in lines if line.strip()], aligned=True)
+        events = iter(decoded)
+        pos = self.upto
+        for line in lines:
+            end = pos + len(line)
+            block = self.blocks[-1] if self.blocks else None
+            if block is None or block.end - block.start >= INDEX_BLOCK_BYTES:
+                block = _Block(pos)
+                self.blocks.append(block)
+            ev = next(events) if line.strip() else None
+            if ev is not None:
+                block.add(ev, end)
+            else:  # blank or undecodable: covered by the block, never matched
+                block.end = end
+            pos = end
+        self.upto = pos
+
+    def ranges(
+        self,
+        session_id: Optional[str] = None,
+        activity_id: Optional[str] = None,
+        thread_id: Optional[str] = None,
+        kinds: Optional[Set[str]] = None,
+        ts_since: Optional[float] = None,
+        ts_until: Optional[float] = None,
+    ) -> List[Tuple[int, int]]:
+        """Byte ranges of the blocks that may hold events matching the filters."""
+        out: List[Tuple[int, int]] = []
+        with self.lock:
+            blocks = list(self.blocks)
+        for b in blocks:
+            if session_id and session_id not in b.session_ids:
+                continue
+            if activity_id and activity_id not in b.activity_ids:
+                continue
+            if thread_id and thread_id not in b.thread_ids:
+                continue
+            if kinds and kinds.isdisjoint(b.kinds):
+                continue
+            if ts_since is not None and b.ts_max < ts_since:
+                continue
+            if ts_until is not None and b.ts_min > ts_until:
+                continue
+            out.append((b.start, b.end))
+        return out
+
+
+_INDEXES: "collections.OrderedDict[pathlib.Path, _LogIndex]" = collections.OrderedDict()
+_INDEXES_LOCK = threading.Lock()
+
+
+def _log_index(path: pathlib.Path) -> _LogIndex:
+    """
+    Return the block index for `path`, creating it on first use and dropping the least
+    recently used one beyond MAX_INDEXED_LOGS (a dropped index is rebuilt on demand).
+    """
+    with _INDEXES_LOCK:
+        idx = _INDEXES.get(path)
+        if idx is not None:
+            _INDEXES.move_to_end(path)
+            return idx
+        idx = _INDEXES[path] = _LogIndex(path)
+        if len(_INDEXES) > MAX_INDEXED_LOGS:
+            _INDEXES.popitem(last=False)
+    return idx
+
+
+def _loads_batch(lines: List[bytes], aligned: bool = False) -> List[Any]:
+    """
+    Decode many NDJSON lines with a single parser call by framing them as one JSON array.
+    If that fails, decode line by line. Lines that aren't a JSON object (a torn write, a
+    stray scalar) are dropped; with `aligned` they come back as None so results line up
+    with `lines`.
+    """
+    evs: Optional[List[Any]]
+    try:
+        evs = _loads(b"[" + b",".join(lines) + b"]")
+        if len(evs) != len(lines):
+            evs = None
+    except ValueError:
+        evs = None
+    if evs is None:
+        evs = []
+        for line in lines:
+            try:
+                evs.append(_loads(line))
+            except ValueError:
+                evs.append(None)
+    if all(type(ev) is dict for ev in evs):
+        return evs
+    if aligned:
+        return [ev if type(ev) is dict else None for ev in evs]
+    return [ev for ev in evs if type(ev) is dict]
+
+
+def _iter_blocks(
+    path: pathlib.Path,
+    session_id: Optional[str] = None,
+    activity_id: Optional[str] = None,
+    thread_id: Optional[str] = None,
+    kinds: Optional[Set[str]] = None,
+    ts_since: Optional[float] = None,
+    ts_until: Optional[float] = None,
+    reverse: bool = False,
+) -> Iterable[List[bytes]]:
+    """
+    Yield the raw NDJSON lines of each block of the log at `path` that may match the
+    filters, in log order (newest block and line first with `reverse`, so "latest N"
+    stops after ~N lines). Callers still apply the filters per event; the index only prunes.
+    """
+    idx = _log_index(path)
+    idx.refresh()
+    ranges = idx.ranges(session_id, activity_id, thread_id, kinds, ts_since, ts_until)
+    if not ranges:
+        return
+    if reverse:
+        ranges.reverse()
+    with path.open("rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        for start, end in ranges:
+            lines = [line for line in mm[start:end].split(b"\n") if line.strip()]
+            if reverse:
+                lines.reverse()
+            yield lines
+
+
+# One condition per list_events filter, in argument order of the compiled function.
+# Hand-edited or legacy lines may lack any of these keys, so they go through `_get`
+# (dict.get bound as a default argument, skipping the attribute lookup per event).
+# A missing ts compares as "" / "~", which falls outside every since / until bound.
+_FILTER_CONDS = (
+    "_get(ev, 'session_id') == session_id",
+    "_get(ev, 'activity_id') == activity_id",
+    "_get(ev, 'thread_id') == thread_id",
+    "_get(ev, 'kind') in kinds",
+    "_get(ev, 'ts', '') >= since",
+    "_get(ev, 'ts', '~') <= until",
+)
+_BatchFilter = Callable[..., List[Dict[str, Any]]]
+
+
+def _ts_key(ev: Dict[str, Any]) -> str:
+    ts = ev.get("ts")
+    return ts if isinstance(ts, str) else ""
+
+
+@functools.lru_cache(maxsize=2 ** len(_FILTER_CONDS))  # every on/off combination
+def _compile_filter(active: Tuple[bool, ...]) -> _BatchFilter:
+    """
+    Build a batch filter that evaluates only the conditions flagged in `active`,
+    so the per-event loop carries no branches for filters the caller didn't pass.
+    The source is assembled from the constants above only, never from input.
+    """
+    conds = [c for c, on in zip(_FILTER_CONDS, active) if on] or ["True"]
+    src = (
+        "def _filter(evs, session_id, activity_id, thread_id, kinds, since, until, _get=dict.get):\n"
+        f"    return [ev for ev in evs if {' and '.join(conds)}]\n"
+    )
+    ns: Dict[str, Any] = {}
+    exec(src, ns)
+    return ns["_filter"]
 
 
 def _load_private_context() -> Dict[str, Any]:
-    """Load private fields (e.g., user_id, ourn) from a local file. Replace with your real loader."""
+    """
+    Load private fields (e.g., user_id, ourn) from a local file. Replace with your real loader.
+    The parsed file is reused until its mtime changes; callers must not mutate the result.
+    """
+    try:
+        mtime: Optional[int] = CONTEXT_PATH.stat().st_mtime_ns
+    except OSError:
+        mtime = None
+    return _read_private_context(CONTEXT_PATH, mtime)
+
+
+@functools.lru_cache(maxsize=1)
+def _read_private_context(path: pathlib.Path, mtime: Optional[int]) -> Dict[str, Any]:
     try:
-        if CONTEXT_PATH.exists():
-            return json.loads(CONTEXT_PATH.read_text(encoding="utf-8"))
+        if mtime is not None:
+            return json.loads(path.read_text(encoding="utf-8"))
     except Exception:
         pass
     # Fallback demo values
     return {"user_id": "user_demo", "ourn": "sql_10min_intro", "cohort": "pilot"}
 
 
-KINDS: set = {
+Kind = Literal[
     "submission",
     "verify",
     "feedback",
@@ -89,7 +718,11 @@ KINDS: set = {
     "reflection",
     "state",
     "metric",
-}
+]
+# FastMCP validates `kind` against the Literal; the set check is kept for in-process
+# callers, since append_event splices `kind` into its JSON template unescaped.
+KINDS: FrozenSet[str] = frozenset(get_args(Kind))
+_INVALID_KIND = "Invalid kind '{}'. Must be one of " + str(sorted(KINDS)) + "."
 
 # --------------------
 # FastMCP app
@@ -108,28 +741,25 @@ def bootstrap_session(expose: Optional[List[str]] = None) -> Dict[str, Any]:
     """
     global _ACTIVE_SESSION_ID
     private_ctx = _load_private_context()  # {user_id, ourn, ...}
-    session_id = f"sess_{secrets.token_hex(4)}"
-    _PRIVATE_CTX[session_id] = {**private_ctx, "ts": now_iso()}
-    _ACTIVE_SESSION_ID = session_id
+    session_id = _new_id("sess_", 4)
+    ctx = {**private_ctx, "ts": now_iso()}
+    with _PRIVATE_CTX_LOCK:
+        _PRIVATE_CTX[session_id] = ctx
+        _ACTIVE_SESSION_ID = session_id
 
     # Log session start WITHOUT leaking private fields
-    ev = {
-        "id": f"evt_{uuid.uuid4().hex}",
-        "ts": now_iso(),
-        "actor": "system",
-        "session_id": session_id,
-        "activity_id": None,
-        "thread_id": None,
-        "kind": "state",
-        "tags": ["session_start"],
-        "data": {"meta": "started"},
-    }
-    _append_line(ev)
+    error = _append_raw(
+        _SESSION_START_TMPL
+        % (_new_id("evt_", 16).encode(), now_iso().encode(), session_id.encode()),
+        session_id,
+    )
+    if error:
+        return {"error": error}
 
     exposed_payload: Dict[str, Any] = {"session_id": session_id}
     for k in expose or []:
-        if k in _PRIVATE_CTX[session_id]:
-            exposed_payload[k] = _PRIVATE_CTX[session_id][k]
+        if k in ctx:
+            exposed_payload[k] = ctx[k]
     return exposed_payload
 
 
@@ -148,9 +778,9 @@ def start_thread(
         return {
             "error": "No active session. Call bootstrap_session first or pass session_id."
         }
-    thread_id = f"thr_{uuid.uuid4().hex[:8]}"
+    thread_id = _new_id("thr_", 4)
     ev = {
-        "id": f"evt_{uuid.uuid4().hex}",
+        "id": _new_id("evt_", 16),
         "ts": now_iso(),
         "actor": "system",
         "session_id": sid,
@@ -160,7 +790,20 @@ def start_thread(
         "tags": ["thread_start"],
         "data": {"metadata": metadata or {}},
     }
-    _append_line(ev)
+    error = _append_raw(
+        _THREAD_START_TMPL
+        % (
+            ev["id"].encode(),
+            ev["ts"].encode(),
+            _dumps(sid),
+            _dumps(activity_id),
+            thread_id.encode(),
+            _dumps(ev["data"]["metadata"]),
+        ),
+        sid,
+    )
+    if error:
+        return {"error": error}
     return {"session_id": sid, "thread_id": thread_id, "event": ev}
 
 
@@ -168,16 +811,7 @@ def start_thread(
 def append_event(
     activity_id: str,
     thread_id: str,
-    kind: Literal[
-        "submission",
-        "verify",
-        "feedback",
-        "hint",
-        "note",
-        "reflection",
-        "state",
-        "metric",
-    ],
+    kind: Kind,
     data: Dict[str, Any],
     tags: Optional[List[str]] = None,
     actor: Optional[str] = None,
@@ -195,10 +829,10 @@ def append_event(
             "error": "No active session. Call bootstrap_session first or pass session_id."
         }
     if kind not in KINDS:
-        return {"error": f"Invalid kind '{kind}'. Must be one of {sorted(KINDS)}."}
+        return {"error": _INVALID_KIND.format(kind)}
 
     ev = {
-        "id": f"evt_{uuid.uuid4().hex}",
+        "id": _new_id("evt_", 16),
         "ts": now_iso(),
         "actor": actor or "llm",
         "session_id": sid,
@@ -210,7 +844,22 @@ def append_event(
         "confidence": confidence,
         "supersedes": supersedes,
     }
-    _append_line(ev)
+    line = _EVENT_TMPL % (
+        ev["id"].encode(),
+        ev["ts"].encode(),
+        _dumps(ev["actor"]),
+        _dumps(sid),
+        _dumps(activity_id),
+        _dumps(thread_id),
+        kind.encode(),
+        _dumps(ev["tags"]),
+        _dumps(data),
+        _dumps(confidence),
+        _dumps(supersedes),
+    )
+    error = _append_raw(line, sid)
+    if error:
+        return {"error": error}
     return ev
 
 
@@ -222,43 +871,71 @@ def list_events(
     kinds: Optional[List[str]] = None,
     since: Optional[str] = None,
     until: Optional[str] = None,
-    limit: int = 200,
+    limit: Optional[int] = None,
 ) -> List[Dict[str, Any]]:
     """
     List events with optional filters (`session_id`, `activity_id`, `thread_id`, `kinds`)
     and time window (`since`, `until`). Timestamps are ISO8601.
+    Without `limit`, returns the first 200 matches. With `limit` (max 2000) and no `since`,
+    returns the latest `limit` matches; results are always oldest first.
     """
-
-    def parse_ts(s: Optional[str]) -> Optional[datetime.datetime]:
-        if not s:
-            return None
-        return datetime.datetime.fromisoformat(s.replace("Z", ""))
-
-    ts_since = parse_ts(since)
-    ts_until = parse_ts(until)
+    # Event timestamps are whole seconds in one fixed format, so the bounds are
+    # rounded inwards and formatted the same way once; per event it's a string compare.
+    ts_since = math.ceil(_parse_ts(since)) if since else None
+    ts_until = math.floor(_parse_ts(until)) if until else None
+    iso_since = _format_ts(ts_since) if ts_since is not None else None
+    iso_until = _format_ts(ts_until) if ts_until is not None else None
     kinds_set = set(kinds or [])
-    out: List[Dict[str, Any]] = []
-    count = 0
-
-    for ev in _iter_events() or []:
-        if session_id and ev.get("session_id") != session_id:
-            continue
-        if activity_id and ev.get("activity_id") != activity_id:
-            continue
-        if thread_id and ev.get("thread_id") != thread_id:
-            continue
-        if kinds_set and ev.get("kind") not in kinds_set:
-            continue
-        ts = datetime.datetime.fromisoformat(ev["ts"].replace("Z", ""))
-        if ts_since and ts < ts_since:
-            continue
-        if ts_until and ts > ts_until:
-            continue
-        out.append(ev)
-        count += 1
-        if count >= max(1, min(limit, 2000)):
-            break
-    return out
+    tail = limit is not None and since is None
+    cap = max(1, min(200 if limit is None else limit, 2000))
+
+    # Cheap substring tests on the raw line before paying for a JSON parse: a
+    # matching event must contain the encoded filter value somewhere.
+    needles = [_dumps(v) for v in (session_id, activity_id, thread_id) if v]
+    kind_re = None
+    if len(kinds_set) == 1:
+        needles.append(_dumps(next(iter(kinds_set))))
+    elif kinds_set:  # any of several kinds: one alternation instead of a generator per line
+        kind_re = re.compile(b"|".join(re.escape(_dumps(k)) for k in kinds_set))
+    # The filter gets kinds as a tuple: `in` on a set would hash, and raise for an unhashable kind.
+    args = (session_id, activity_id, thread_id, tuple(kinds_set), iso_since, iso_until)
+    keep = _compile_filter(tuple(bool(a) for a in args))
+
+    def scan(path: pathlib.Path) -> List[Dict[str, Any]]:
+        """Up to `cap` matches from one log file, oldest first."""
+        out: List[Dict[str, Any]] = []
+        for lines in _iter_blocks(
+            path, session_id, activity_id, thread_id, kinds_set, ts_since, ts_until, tail
+        ):
+            for n in needles:  # each pass is one flat `in` test per surviving line
+                lines = [raw for raw in lines if n in raw]
+            if kind_re is not None:
+                search = kind_re.search
+                lines = [raw for raw in lines if search(raw)]
+            if not lines:
+                continue
+            # Decode a block's survivors in one call, then filter the batch.
+            out.extend(keep(_loads_batch(lines), *args))
+            if len(out) >= cap:
+                del out[cap:]
+                break
+        if tail:
+            out.reverse()
+        return out
+
+    _flush()  # read-your-writes; a failure stays in _WRITE_ERROR for the next writer
+    if session_id:
+        # The session's own log, plus LOG_PATH for events from before sharding.
+        paths = list(dict.fromkeys([LOG_PATH, _shard_path(session_id)]))
+    else:
+        paths = _shard_paths()
+    # Reads and mmap page-ins release the GIL, so shards are scanned side by side.
+    scanned = map(scan, paths) if len(paths) == 1 else _SCAN_POOL.map(scan, paths)
+    results = [r for r in scanned if r]
+    if len(results) <= 1:
+        return results[0] if results else []
+    merged = list(heapq.merge(*results, key=_ts_key))
+    return merged[-cap:] if tail else merged[:cap]
 
 
 if __name__ == "__main__":
@@ -279,6 +956,6 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     LOG_PATH = pathlib.Path(args.log_dir) / args.log_file
-    LOCK_PATH = pathlib.Path(str(LOG_PATH) + ".lock")
+    _ensure_log_dir()
 
     mcp.run()